@@ -1,15 +1,29 @@
 import requests
-import json
+import urllib3
+import orjson
+import copy
 import re
+import numpy as np
 import pandas as pd
+import openpyxl
 import gspread
-from gspread_dataframe import set_with_dataframe
+from gspread.utils import absolute_range_name
 from google.oauth2.service_account import Credentials
-import pytz
-import time
 from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
 import os
+import io
+import shutil
 import argparse
+import logging as log
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial, lru_cache
+from importlib.util import find_spec
+
+from odoo_client import make_adapter, make_session, with_sheets_backoff, write_dataframe_to_range
+
+# ========= LOGGING ==========
+log.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
 # ========= CONFIG ==========
 ODOO_URL = os.getenv("ODOO_URL")
@@ -18,128 +32,211 @@ PASSWORD = os.getenv("PASSWORD")
 DB = os.getenv("ODOO_DB")
 
 MODEL = "attendance.pdf.report"
+ATTENDANCE_MODEL = "hr.attendance"
 REPORT_BUTTON_METHOD = "action_generate_xlsx_report"
 
+CSRF_MARKER = b'csrf_token: "'  # as in Odoo's bootstrap script: var odoo = { csrf_token: "..." }
+CSRF_SCAN_BYTES = 8192  # how much of the /web page to scan for the token first (it sits in <head>)
+
+# Report day headers look like "26 Jul Fri": day, month name, weekday
+MONTH_TO_NUM = {m: i + 1 for i, m in enumerate(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                                                'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])}
+DATE_RE = re.compile(r'(\d{1,2})\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+(\w{3}\S*)', re.IGNORECASE)
+
+XLSX_MAGIC = b"PK\x03\x04"  # xlsx is a ZIP archive; every one starts with this header
+
+# pandas' Rust-backed xlsx reader, when python-calamine is installed
+XLSX_ENGINE = "calamine" if find_spec("python_calamine") else None
+
 # -------- Dates (from GitHub Action inputs or default) --------
-local_tz = pytz.timezone("Asia/Dhaka")
+local_tz = ZoneInfo("Asia/Dhaka")
 DATE_FROM_DEFAULT = "2025-07-26"
 DATE_TO_DEFAULT = (datetime.now(local_tz) - timedelta(days=1)).strftime("%Y-%m-%d")
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--from_date", type=str, default=DATE_FROM_DEFAULT)
-parser.add_argument("--to_date", type=str, default=DATE_TO_DEFAULT)
-args = parser.parse_args()
-
-DATE_FROM = args.from_date
-DATE_TO = args.to_date
-
+# -------- Per-company settings --------
+# label: used in file names; worksheet: target tab; clear_end_column: last column of the data block
+COMPANY_CONFIG = {
+    1: {"label": "Zipper", "worksheet": "ZIP_OT_DATA", "clear_end_column": "IA"},
+    3: {"label": "Metal_Trims", "worksheet": "MT_OT_DATA", "clear_end_column": "IA"},
+}
 COMPANY_IDS = [1, 3]  # 1 = Zipper, 3 = Metal Trims
 
 # ========= GOOGLE SHEET CONFIG ==========
 SERVICE_ACCOUNT_FILE = "gcreds.json"   # GitHub Action will create this from secret
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+SHEET_KEY = "1-kBuln5CnKucuHqYG4vvgttJ8DqeJALvr4TjAYuVkXs"
+ROW_COUNT_CELL = "A1"  # holds the number of rows written by the last run
+LAST_RUN_CELL = "A2"  # when the sheet was last checked against Odoo (column A is outside the data block)
 
-creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-client = gspread.authorize(creds)
+# --------- Helper functions ----------
 
-# ========= START SESSION ==========
-session = requests.Session()
-session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"})
+# One connection pool shared by every session we create, so the worker
+# threads reuse the keep-alive TLS connections opened by the login session
+# instead of each handshaking with Odoo again.
+# urllib3 is the only retry layer for Odoo (see odoo_client.make_adapter):
+# failed connects and 408/429 are retried, read timeouts and 5xx are not, as
+# web_save, call_button and the report download are not idempotent.
+RETRYABLE_CLIENT_ERRORS = (408, 429)  # 4xx worth asking again: request timeout, rate limited
+HTTP_ADAPTER = make_adapter(pool_maxsize=16, retry_statuses=RETRYABLE_CLIENT_ERRORS)
+SESSION_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    "Connection": "keep-alive",
+    "Accept-Encoding": "gzip, deflate",
+}
 
-# --------- Helper functions ----------
 
-def safe_post_json(session, url, payload=None, headers=None, retries=3, timeout=60):
+def safe_post_json(session, url, payload=None, headers=None, timeout=60):
     """
     POST json payload and return parsed JSON dict.
-    Retries on network/5xx or invalid JSON up to retries times.
-    Returns parsed json dict on success, or None on final failure.
+    Failed connects and 408/429 are already retried by the session's urllib3
+    Retry; read timeouts and 5xx are not, so this makes a single call.
+    Returns parsed json dict on success, or None on failure.
+    The payload is serialized once with orjson and sent as the raw body.
     """
-    for attempt in range(1, retries + 1):
-        try:
-            resp = session.post(url, json=payload, headers=headers, timeout=timeout)
-        except requests.RequestException as e:
-            print(f"RequestException on attempt {attempt} for {url}: {e}")
-            if attempt < retries:
-                sleep_t = min(60, 2 ** attempt)
-                print(f" retrying in {sleep_t}s ...")
-                time.sleep(sleep_t)
-                continue
-            else:
-                print(" final failure (network).")
-                return None
-
-        if resp.status_code >= 500:
-            print(f"Server error {resp.status_code} on attempt {attempt} for {url}: {resp.text[:300]}")
-            if attempt < retries:
-                sleep_t = min(60, 2 ** attempt)
-                print(f" retrying in {sleep_t}s ...")
-                time.sleep(sleep_t)
-                continue
-            else:
-                print(" final failure (server error).")
-                return None
-
-        # try parse JSON
-        try:
-            data = resp.json()
-            return data
-        except ValueError:  # JSONDecodeError
-            print(f"Invalid JSON on attempt {attempt} for {url}. Status: {resp.status_code}. Response start:\n{resp.text[:500]}")
-            if attempt < retries:
-                sleep_t = min(60, 2 ** attempt)
-                print(f" retrying in {sleep_t}s ...")
-                time.sleep(sleep_t)
-                continue
-            else:
-                print(" final failure (invalid JSON).")
-                return None
-
-
-def download_report_with_retries(session, url, data, headers=None, max_attempts=5, timeout=60):
+    body = orjson.dumps(payload)
+    post_headers = {"Content-Type": "application/json", **(headers or {})}
+    try:
+        resp = session.post(url, data=body, headers=post_headers, timeout=timeout)
+    except requests.RequestException as e:
+        log.error("RequestException for %s: %s", url, e)
+        return None
+
+    if resp.status_code >= 500:
+        log.error("Server error %s for %s: %s", resp.status_code, url, resp.text[:300])
+        return None
+
+    # timeout / rate limit: retryable, and urllib3 already retried them
+    if resp.status_code in RETRYABLE_CLIENT_ERRORS:
+        log.error("Client error %s for %s (after retries): %s", resp.status_code, url, resp.text[:300])
+        return None
+
+    # Odoo answers JSON-RPC errors with 200; any other 4xx (expired session behind a
+    # proxy, bad route, permissions) won't get better by asking again, so report it as such
+    if 400 <= resp.status_code < 500:
+        log.error("Client error %s for %s (not retried): %s", resp.status_code, url, resp.text[:300])
+        return None
+
+    # try parse JSON
+    try:
+        return orjson.loads(resp.content)
+    except ValueError:  # orjson.JSONDecodeError
+        log.error("Invalid JSON for %s. Status: %s. Response start:\n%s", url, resp.status_code, resp.text[:500])
+        return None
+
+
+def find_csrf_token(body):
+    """
+    Token value following CSRF_MARKER in body (bytes), or None if it isn't
+    there (yet). Two plain find() scans, no regex.
+    """
+    start = body.find(CSRF_MARKER)
+    if start == -1:
+        return None
+    start += len(CSRF_MARKER)
+    end = body.find(b'"', start)
+    if end == -1:
+        return None
+    return body[start:end]
+
+
+def download_report(session, url, data, out, headers=None, timeout=60):
     """
-    POST form/data to download endpoint. If returned content is XLSX (or ZIP/PK signature),
-    return resp. Otherwise retry up to max_attempts when status is 5xx or invalid content.
-    Returns resp on final attempt even if not valid (caller decides).
+    POST form/data to download endpoint with stream=True and stream the body into
+    the file-like out. The first four bytes are peeked first: xlsx files start with
+    the ZIP local-file header (PK\\x03\\x04), so anything else (an Odoo error page)
+    is rejected without reading the rest. Failed connects and 408/429 are
+    retried by the session's urllib3 Retry; the render itself is not re-sent.
+    Returns True once an xlsx has been written to out, False otherwise.
     """
-    for attempt in range(1, max_attempts + 1):
+    try:
+        resp = session.post(url, data=data, headers=headers, timeout=timeout, stream=True)
+    except requests.RequestException as e:
+        log.error("Download RequestException: %s", e)
+        return False
+
+    with resp:
+        # read the decompressed body straight off the socket, bypassing resp.content
+        resp.raw.decode_content = True
         try:
-            resp = session.post(url, data=data, headers=headers, timeout=timeout)
-        except requests.RequestException as e:
-            print(f"Download RequestException on attempt {attempt}: {e}")
-            if attempt < max_attempts:
-                sleep_t = min(60, 2 ** attempt)
-                print(f" retrying download in {sleep_t}s ...")
-                time.sleep(sleep_t)
-                continue
-            else:
-                print(" final download failure (network).")
-                return None
-
-        content_type = resp.headers.get("content-type", "")
-        # heuristics: check content type or file bytes (xlsx files start with PK because they are ZIP)
-        is_xlsx_by_type = "openxmlformats-officedocument.spreadsheetml.sheet" in content_type.lower()
-        is_zip_header = isinstance(resp.content, (bytes, bytearray)) and resp.content.startswith(b"PK")
-
-        if resp.status_code == 200 and (is_xlsx_by_type or is_zip_header):
-            return resp
-
-        # If 5xx or Bad Gateway, retry
-        print(f"Attempt {attempt} - download returned status {resp.status_code}, content-type: {content_type}")
-        # show a snippet safely (text may be HTML)
+            sig = resp.raw.read(4) if resp.status_code == 200 else b""
+            if sig == XLSX_MAGIC:
+                # with stream=True, elapsed is time-to-headers, i.e. Odoo's server-side render time
+                log.info(" report rendered by Odoo in %.1fs", resp.elapsed.total_seconds())
+                out.write(sig)
+                shutil.copyfileobj(resp.raw, out, 1 << 20)
+                return True
+            # Not the xlsx: log what came back instead (bounded, text may be HTML)
+            snippet = (sig + resp.raw.read(500)).decode("utf-8", "replace")
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            log.error("Download interrupted: %s", e)
+            return False
+    content_type = resp.headers.get("content-type", "")
+    log.error("Download returned status %s, content-type: %s", resp.status_code, content_type)
+    log.error(" Response snippet: %s", snippet)
+    return False
+
+
+def read_report_sheet(buf, sheet_index):
+    """
+    Read one sheet of the xlsx in buf into a DataFrame.
+    Uses the Rust-backed calamine engine (python-calamine); if that isn't
+    available, falls back to openpyxl in read_only mode, which streams rows
+    instead of building the whole workbook in memory.
+    """
+    # No usecols/dtype pinning here: the report has one column per day of the
+    # requested range (so its width changes every run), every column is written
+    # to the sheet, and each one mixes the header rows' text with numbers.
+    if XLSX_ENGINE:
+        return pd.read_excel(buf, sheet_name=sheet_index, engine=XLSX_ENGINE)
+
+    log.warning("⚠️ python-calamine not installed, falling back to openpyxl read_only")
+    wb = openpyxl.load_workbook(buf, read_only=True, data_only=True)
+    try:
+        rows = list(wb.worksheets[sheet_index].iter_rows(values_only=True))
+    finally:
+        wb.close()
+    if not rows:
+        return pd.DataFrame()
+    header = [f"Unnamed: {i}" if name is None else name for i, name in enumerate(rows[0])]
+    return pd.DataFrame(rows[1:], columns=header)
+
+
+def previous_row_counts(spreadsheet, titles, row_count_cell, default=1000):
+    """
+    Rows written by the previous run to each worksheet in titles, as recorded in
+    its row_count_cell, read for all of them in one values.batchGet call.
+    Returns {title: rows}; falls back to default when a cell is empty or not a number.
+    The cells are read unformatted, so a number format on them (e.g. "1,500")
+    doesn't hide the count.
+    """
+    ranges = [absolute_range_name(title, row_count_cell) for title in titles]
+    params = {"valueRenderOption": "UNFORMATTED_VALUE"}
+    value_ranges = spreadsheet.values_batch_get(ranges, params=params).get("valueRanges", [])
+    counts = {}
+    for title, value_range in zip(titles, value_ranges):
+        cell = (value_range.get("values") or [[None]])[0]
+        value = cell[0] if cell else None
         try:
-            snippet = resp.text[:500]
-        except Exception:
-            snippet = repr(resp.content[:200])
-        print(" Response snippet:", snippet)
+            counts[title] = int(value or default)
+        except (TypeError, ValueError):
+            counts[title] = default
+    return counts
 
-        if attempt < max_attempts:
-            sleep_t = min(60, 2 ** attempt)
-            print(f" retrying download in {sleep_t}s ...")
-            time.sleep(sleep_t)
-            continue
-        else:
-            print(" final download attempt failed.")
-            return resp
+
+@lru_cache(maxsize=None)
+def month_year_lookup(date_from_str, date_to_str):
+    """
+    Year to use for each month (index 1-12; index 0 unused) when the report
+    covers date_from_str..date_to_str: if month is >= the from-month, use the
+    from-year, otherwise the to-year (for wrap-around like Jul-Dec 2025, Jan 2026).
+    Cached, so every company's report for the same range shares one lookup.
+    """
+    from_date = pd.to_datetime(date_from_str)
+    to_date = pd.to_datetime(date_to_str)
+    if from_date.year == to_date.year:
+        return (from_date.year,) * 13
+    return tuple(from_date.year if month_num >= from_date.month else to_date.year
+                 for month_num in range(13))
 
 
 def smart_fix_dates_in_dataframe(df, date_from_str, date_to_str):
@@ -151,164 +248,264 @@ def smart_fix_dates_in_dataframe(df, date_from_str, date_to_str):
     from_date = pd.to_datetime(date_from_str)
     to_date = pd.to_datetime(date_to_str)
     
-    print(f"🗓️ Date range: {from_date.strftime('%Y-%m-%d')} to {to_date.strftime('%Y-%m-%d')}")
+    log.info("🗓️ Date range: %s to %s", from_date.strftime('%Y-%m-%d'), to_date.strftime('%Y-%m-%d'))
     
     total_fixes = 0
     
-    # Month name mapping
-    month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                   'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    year_by_month = np.asarray(month_year_lookup(date_from_str, date_to_str))
     
-    # Iterate through all columns
-    for col in df.columns:
-        if df[col].dtype == 'object':  # String columns
-            # Check if this column contains date-like strings
-            sample = df[col].dropna().astype(str).head(10)
-            
-            # Look for patterns like "26 Jul Fri" or "05 Jan Mon"
-            date_pattern = r'\d{1,2}\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\w{3}'
-            
-            has_dates = any(re.search(date_pattern, str(val), re.IGNORECASE) for val in sample)
-            
-            if has_dates:
-                print(f"🔍 Found date column: '{col}'")
-                fixed_values = []
-                
-                for idx, val in df[col].items():
-                    if pd.isna(val):
-                        fixed_values.append(val)
-                        continue
-                    
-                    val_str = str(val)
-                    match = re.search(date_pattern, val_str, re.IGNORECASE)
-                    
-                    if match:
-                        # Extract day and month
-                        parts = val_str.split()
-                        day = parts[0]
-                        month = parts[1]
-                        
-                        # Determine correct year based on month
-                        month_num = month_names.index(month) + 1 if month in month_names else 1
-                        
-                        # If month is >= from_date.month, use from_date.year
-                        # Otherwise use to_date.year (for wrap-around like Jul-Dec 2025, Jan 2026)
-                        if from_date.year == to_date.year:
-                            year = from_date.year
-                        elif month_num >= from_date.month:
-                            year = from_date.year
-                        else:
-                            year = to_date.year
-                        
-                        # Reconstruct the date string with correct year
-                        new_val = f"{day} {month} {year} {parts[2] if len(parts) > 2 else ''}"
-                        fixed_values.append(new_val.strip())
-                        total_fixes += 1
-                    else:
-                        fixed_values.append(val)
-                
-                df[col] = fixed_values
-                print(f"  ✅ Fixed {total_fixes} date values in column '{col}'")
+    # Check which string columns contain date-like strings, looking only at the
+    # top rows (the day headers sit there) so the full column is scanned just
+    # for real date columns. The top cells of every string column go through
+    # one vectorized regex pass instead of one small .str call per column.
+    # Look for patterns like "26 Jul Fri" or "05 Jan Mon"
+    object_cols = df.select_dtypes(include='object').columns
+    top = df[object_cols].head(20).to_numpy(dtype=object)
+    top_hits = pd.Series(top.ravel(order="F")).astype(str).str.extract(DATE_RE)[1].notna()
+    date_cols = object_cols[top_hits.to_numpy().reshape(len(object_cols), len(top)).any(axis=1)]
     
-    print(f"📊 Total date fixes applied: {total_fixes}")
+    for col in date_cols:
+        log.info("🔍 Found date column: '%s'", col)
+
+    if len(date_cols):
+        # All date columns are rewritten together: one regex pass over their text
+        # cells (day, month, weekday per cell) instead of one pandas call chain per
+        # column. Numbers/NaN can never look like "26 Jul Fri", so they're not stringified.
+        block = df[date_cols].to_numpy(dtype=object)
+        values = block.ravel(order="F")  # column after column
+        text_pos = np.flatnonzero(pd.Series(values).map(type).eq(str).to_numpy())
+        extracted = pd.Series(values[text_pos]).str.extract(DATE_RE)
+        hit = extracted[1].notna().to_numpy()
+        extracted = extracted[hit]
+        day, month, weekday = extracted[0], extracted[1], extracted[2]
+
+        # Determine correct year based on month (see month_year_lookup)
+        month_num = month.str.title().map(MONTH_TO_NUM).fillna(1).to_numpy(dtype=np.int8)
+        year = year_by_month[month_num]
+
+        # Reconstruct the date strings with correct year, written by position into
+        # the flat copy and swapped back in as a block (no per-label setitem)
+        values[text_pos[hit]] = (day + " " + month + " " + year.astype(str) + " " + weekday).to_numpy()
+        df[date_cols] = values.reshape(block.shape, order="F")
+
+        fixes_per_col = np.bincount(text_pos[hit] // len(df), minlength=len(date_cols))
+        for col, fixes in zip(date_cols, fixes_per_col):
+            log.info("  ✅ Fixed %s date values in column '%s'", fixes, col)
+        total_fixes = int(fixes_per_col.sum())
+
+    log.info("📊 Total date fixes applied: %s", total_fixes)
     return df
 
 
-# ---------------------- Step 1: Login (with safe JSON handling)
-login_url = f"{ODOO_URL}/web/session/authenticate"
-login_payload = {
-    "jsonrpc": "2.0",
-    "params": {"db": DB, "login": USERNAME, "password": PASSWORD}
+# --------- JSON-RPC payload builders ----------
+# Everything that is the same for every company lives in these templates;
+# the builders below only copy them and fill in the per-company keys.
+
+BASE_CONTEXT = {"lang": "en_US", "tz": "Asia/Dhaka", "default_is_company": False}
+
+WIZARD_SPECIFICATION = {
+    "report_type": {}, "date_from": {}, "date_to": {}, "is_company": {},
+    "atten_type": {}, "types": {}, "mode_type": {},
+    "employee_id": {"fields": {"display_name": {}}},
+    "mode_company_id": {"fields": {"display_name": {}}},
+    "category_id": {"fields": {"display_name": {}}},
+    "department_id": {"fields": {"display_name": {}}},
+    "company_all": {}
+}
+
+WIZARD_VALUES = {
+    "report_type": "ot_analysis",
+    "date_from": False,
+    "date_to": False,
+    "is_company": False,
+    "atten_type": False,
+    "types": False,
+    "mode_type": "company",
+    "employee_id": False,
+    "mode_company_id": False,
+    "category_id": False,
+    "department_id": False,
+    "company_all": "allcompany"
+}
+
+REPORT_OPTIONS = {
+    "date_from": False,
+    "date_to": False,
+    "mode_company_id": False,
+    "department_id": False,
+    "category_id": False,
+    "employee_id": False,
+    "report_type": "ot_analysis",
+    "atten_type": False,
+    "types": False,
+    "is_company": False
 }
-login_result = safe_post_json(session, login_url, payload=login_payload, retries=3, timeout=30)
-if not login_result:
-    print("❌ Login failed (no JSON response). Exiting.")
-    raise SystemExit(1)
-
-uid = login_result.get("result", {}).get("uid")
-print("✅ Logged in, UID =", uid)
-
-# ---------------------- Step 2: Get CSRF token (safe)
-resp = session.get(f"{ODOO_URL}/web", timeout=30)
-match = re.search(r'var odoo = {\s*csrf_token: "([A-Za-z0-9]+)"', resp.text)
-csrf_token = match.group(1) if match else None
-print("✅ CSRF token =", csrf_token)
-
-# ---------------------- Iterate over companies
-for company_id in COMPANY_IDS:
-    print(f"\n--- Processing company_id {company_id} ---")
-
-    # ---------------------- Step 3: Onchange to get defaults
-    onchange_url = f"{ODOO_URL}/web/dataset/call_kw/{MODEL}/onchange"
-    onchange_payload = {
-        "id": 1,
+
+
+def rpc_context(company_id, uid):
+    context = copy.copy(BASE_CONTEXT)
+    context["uid"] = uid
+    context["allowed_company_ids"] = [company_id]
+    return context
+
+
+def rpc_payload(rpc_id, method, args, kwargs, model=MODEL):
+    return {
+        "id": rpc_id,
         "jsonrpc": "2.0",
         "method": "call",
-        "params": {
-            "model": MODEL,
-            "method": "onchange",
-            "args": [[], {}, [], {
-                "report_type": {}, "date_from": {}, "date_to": {},
-                "is_company": {}, "atten_type": {}, "types": {}, "mode_type": {},
-                "employee_id": {"fields": {"display_name": {}}},
-                "mode_company_id": {"fields": {"display_name": {}}},
-                "category_id": {"fields": {"display_name": {}}},
-                "department_id": {"fields": {"display_name": {}}},
-                "company_all": {}
-            }],
-            "kwargs": {"context": {"lang": "en_US", "tz": "Asia/Dhaka", "uid": uid,
-                                   "allowed_company_ids": [company_id], "default_is_company": False}}
-        }
+        "params": {"model": model, "method": method, "args": args, "kwargs": kwargs}
     }
-    onchange_data = safe_post_json(session, onchange_url, payload=onchange_payload, retries=3, timeout=30)
-    if not onchange_data:
-        print(f"❌ Failed to get onchange defaults for company {company_id}. Skipping this company.")
-        continue
-    wizard_defaults = onchange_data.get("result", {}).get("value", {})
-    print("✅ Onchange defaults:", wizard_defaults)
-
-    # ---------------------- Step 4: Save wizard
-    web_save_url = f"{ODOO_URL}/web/dataset/call_kw/{MODEL}/web_save"
-    web_save_payload = {
-        "id": 3,
+
+
+def attendance_count_payload(company_id, uid, date_from, date_to):
+    # same scope as the report: the company's employees over the date range
+    domain = ["&", "&", ["employee_id.company_id", "=", company_id],
+              ["attDate", ">=", date_from], ["attDate", "<=", date_to]]
+    return rpc_payload(2, "search_count", [domain],
+                       {"context": rpc_context(company_id, uid)}, model=ATTENDANCE_MODEL)
+
+
+def web_save_payload(company_id, uid, date_from, date_to):
+    values = copy.copy(WIZARD_VALUES)
+    values["date_from"] = date_from
+    values["date_to"] = date_to
+    values["mode_company_id"] = company_id
+    return rpc_payload(3, "web_save", [[], values],
+                       {"context": rpc_context(company_id, uid), "specification": WIZARD_SPECIFICATION})
+
+
+def call_button_payload(company_id, uid, wizard_id):
+    return rpc_payload(4, REPORT_BUTTON_METHOD, [[wizard_id]],
+                       {"context": rpc_context(company_id, uid)})
+
+
+def report_options(company_id, date_from, date_to):
+    options = copy.copy(REPORT_OPTIONS)
+    options["date_from"] = date_from
+    options["date_to"] = date_to
+    options["mode_company_id"] = company_id
+    return options
+
+
+def report_context(company_id, uid, wizard_id):
+    context = rpc_context(company_id, uid)
+    context["active_model"] = MODEL
+    context["active_id"] = wizard_id
+    context["active_ids"] = [wizard_id]
+    return context
+
+
+# ---------------------- Steps 1-2: Login and CSRF token
+def login():
+    """
+    Log in to Odoo once and fetch the CSRF token.
+    Returns (session, uid, csrf_token); exits the process if login fails.
+    """
+    session = make_session(headers=SESSION_HEADERS, adapter=HTTP_ADAPTER)
+
+    # ---------------------- Step 1: Login (with safe JSON handling)
+    login_url = f"{ODOO_URL}/web/session/authenticate"
+    login_payload = {
         "jsonrpc": "2.0",
-        "method": "call",
-        "params": {
-            "model": MODEL,
-            "method": "web_save",
-            "args": [[], {
-                "report_type": "ot_analysis",
-                "date_from": DATE_FROM,
-                "date_to": DATE_TO,
-                "is_company": False,
-                "atten_type": False,
-                "types": False,
-                "mode_type": "company",
-                "employee_id": False,
-                "mode_company_id": company_id,
-                "category_id": False,
-                "department_id": False,
-                "company_all": "allcompany"
-            }],
-            "kwargs": {
-                "context": {"lang": "en_US", "tz": "Asia/Dhaka", "uid": uid,
-                            "allowed_company_ids": [company_id], "default_is_company": False},
-                "specification": {
-                    "report_type": {}, "date_from": {}, "date_to": {}, "is_company": {},
-                    "atten_type": {}, "types": {}, "mode_type": {},
-                    "employee_id": {"fields": {"display_name": {}}},
-                    "mode_company_id": {"fields": {"display_name": {}}},
-                    "category_id": {"fields": {"display_name": {}}},
-                    "department_id": {"fields": {"display_name": {}}},
-                    "company_all": {}
-                }
-            }
-        }
+        "params": {"db": DB, "login": USERNAME, "password": PASSWORD}
     }
-    web_save_data = safe_post_json(session, web_save_url, payload=web_save_payload, retries=3, timeout=30)
+    login_result = safe_post_json(session, login_url, payload=login_payload, timeout=30)
+    if not login_result:
+        log.error("❌ Login failed (no JSON response). Exiting.")
+        raise SystemExit(1)
+
+    uid = login_result.get("result", {}).get("uid")
+    log.info("✅ Logged in")
+    log.debug("UID = %s", uid)
+
+    # ---------------------- Step 2: Get CSRF token (safe)
+    # Odoo emits the token in its bootstrap <script> near the top of the page,
+    # so only read the head of the body; fall back to the rest if it isn't there.
+    with session.get(f"{ODOO_URL}/web", timeout=30, stream=True) as resp:
+        head = resp.raw.read(CSRF_SCAN_BYTES, decode_content=True)
+        token = find_csrf_token(head)
+        if token is None:
+            token = find_csrf_token(head + resp.raw.read(decode_content=True))
+    csrf_token = token.decode() if token else None
+    log.info("✅ CSRF token %s", "found" if csrf_token else "not found")
+    log.debug("CSRF token = %s", csrf_token)
+    return session, uid, csrf_token
+
+
+# ---------------------- Step 6: Push to Google Sheets
+def push_report_to_sheet(spreadsheet, worksheets, row_counts, company_id, df):
+    """
+    Replace company_id's block on its worksheet with df and record the row count
+    and run time, in one request; backs off on rate limit / unavailable.
+    The spreadsheet, worksheets (by title) and the last runs' row counts (by title)
+    were resolved once in run().
+    """
+    company = COMPANY_CONFIG[company_id]
+    worksheet = worksheets[company["worksheet"]]
+
+    # Only clear as many rows as the last run wrote (or this run writes, if more)
+    prev_rows = row_counts[company["worksheet"]]
+    rows_to_clear = max(prev_rows, len(df) + 1)
+    clear_range = f"B1:{company['clear_end_column']}{rows_to_clear}"
+
+    with_sheets_backoff(lambda: write_dataframe_to_range(spreadsheet, worksheet, df, clear_range,
+                                                         row_count_cell=ROW_COUNT_CELL,
+                                                         extra_cells={LAST_RUN_CELL: run_timestamp()}))
+    log.info("✅ Cleared range %s", clear_range)
+
+
+def push_timestamp_to_sheet(spreadsheet, company_id):
+    """
+    Only stamp company_id's worksheet with the run time; its data block and row
+    count are left exactly as the last report wrote them.
+    """
+    title = COMPANY_CONFIG[company_id]["worksheet"]
+    data = [{"range": absolute_range_name(title, LAST_RUN_CELL), "values": [[run_timestamp()]]}]
+    with_sheets_backoff(lambda: spreadsheet.values_batch_update({"valueInputOption": "USER_ENTERED", "data": data}))
+    log.info("✅ Updated timestamp %s on %s", LAST_RUN_CELL, title)
+
+
+def run_timestamp():
+    # leading apostrophe keeps Sheets from turning it into a date serial
+    return "'" + datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ---------------------- Per-company pipeline
+def process_company(company_id, uid, csrf_token, cookies, spreadsheet, worksheets, row_counts, date_from, date_to):
+    """
+    Generate, download and upload the OT report for one company.
+    Returns True when the company's sheet is up to date, False if a step failed.
+    Runs in its own thread with its own requests.Session (seeded with the
+    login cookies). The spreadsheet and its worksheets (by title) are opened
+    once by run() and shared, as are the last runs' row counts (by title);
+    each company only writes its own worksheet.
+    """
+    session = make_session(cookies=cookies, headers=SESSION_HEADERS, adapter=HTTP_ADAPTER)
+
+    log.info("--- Processing company_id %s ---", company_id)
+
+    # Cheap count first: an empty range would otherwise cost the whole wizard,
+    # render and download just to find no rows. If the count call itself fails,
+    # carry on with the report as before.
+    count_url = f"{ODOO_URL}/web/dataset/call_kw/{ATTENDANCE_MODEL}/search_count"
+    count_data = safe_post_json(session, count_url, payload=attendance_count_payload(company_id, uid, date_from, date_to), timeout=30)
+    if count_data and count_data.get("result") == 0:
+        log.info("⏭️ No attendance for company %s between %s and %s, skipping report (sheet left as is).",
+                 company_id, date_from, date_to)
+        try:
+            push_timestamp_to_sheet(spreadsheet, company_id)
+            return True
+        except Exception as e:
+            log.exception("❌ Failed to update the timestamp for company %s: %s", company_id, e)
+            return False
+
+    # ---------------------- Step 3: Save wizard (every field is given, so no onchange for defaults)
+    web_save_url = f"{ODOO_URL}/web/dataset/call_kw/{MODEL}/web_save"
+    web_save_data = safe_post_json(session, web_save_url, payload=web_save_payload(company_id, uid, date_from, date_to), timeout=30)
     if not web_save_data:
-        print(f"❌ Failed to save wizard for company {company_id}. Skipping this company.")
-        continue
+        log.error("❌ Failed to save wizard for company %s. Skipping this company.", company_id)
+        return False
 
     # extract wizard id robustly
     wizard_id = None
@@ -317,127 +514,134 @@ for company_id in COMPANY_IDS:
         wizard_id = result_obj[0].get("id")
     elif isinstance(result_obj, dict):
         wizard_id = result_obj.get("id")
-    print("✅ Wizard saved, ID =", wizard_id)
+    log.info("✅ Wizard saved, ID = %s", wizard_id)
     if not wizard_id:
-        print(f"❌ No wizard_id returned for company {company_id}. Skipping.")
-        continue
+        log.error("❌ No wizard_id returned for company %s. Skipping.", company_id)
+        return False
 
-    # ---------------------- Step 5: Call report button
+    # ---------------------- Step 4: Call report button
     call_button_url = f"{ODOO_URL}/web/dataset/call_button"
-    call_button_payload = {
-        "id": 4,
-        "jsonrpc": "2.0",
-        "method": "call",
-        "params": {
-            "model": MODEL,
-            "method": REPORT_BUTTON_METHOD,
-            "args": [[wizard_id]],
-            "kwargs": {"context": {"lang": "en_US", "tz": "Asia/Dhaka",
-                                   "uid": uid, "allowed_company_ids": [company_id], "default_is_company": False}}
-        }
-    }
-    call_button_data = safe_post_json(session, call_button_url, payload=call_button_payload, retries=3, timeout=60)
+    call_button_data = safe_post_json(session, call_button_url, payload=call_button_payload(company_id, uid, wizard_id), timeout=60)
     if not call_button_data:
-        print(f"❌ Call button failed for company {company_id}. Skipping.")
-        continue
+        log.error("❌ Call button failed for company %s. Skipping.", company_id)
+        return False
     report_info = call_button_data.get("result", {})
     report_name = report_info.get("report_name") or report_info.get("report")
-    print("✅ Report generated:", report_name)
+    log.info("✅ Report generated: %s", report_name)
 
-    # ---------------------- Step 6: Download report (with retry up to 5 attempts)
+    # ---------------------- Step 5: Download report
     download_url = f"{ODOO_URL}/report/download"
-    options = {
-        "date_from": DATE_FROM,
-        "date_to": DATE_TO,
-        "mode_company_id": company_id,
-        "department_id": False,
-        "category_id": False,
-        "employee_id": False,
-        "report_type": "ot_analysis",
-        "atten_type": False,
-        "types": False,
-        "is_company": False
-    }
-    context = {
-        "lang": "en_US",
-        "tz": "Asia/Dhaka",
-        "uid": uid,
-        "allowed_company_ids": [company_id],
-        "active_model": MODEL,
-        "active_id": wizard_id,
-        "active_ids": [wizard_id],
-        "default_is_company": False
-    }
-    report_path = f"/report/xlsx/{report_name}?options={json.dumps(options)}&context={json.dumps(context)}"
+    options = report_options(company_id, date_from, date_to)
+    context = report_context(company_id, uid, wizard_id)
+    context_json = orjson.dumps(context).decode()
+    report_path = f"/report/xlsx/{report_name}?options={orjson.dumps(options).decode()}&context={context_json}"
     download_payload = {
-        "data": json.dumps([report_path, "xlsx"]),
-        "context": json.dumps(context),
+        "data": orjson.dumps([report_path, "xlsx"]).decode(),
+        "context": context_json,
         "token": "dummy-because-api-expects-one",
         "csrf_token": csrf_token
     }
-    headers = {"X-CSRF-Token": csrf_token, "Referer": f"{ODOO_URL}/web"}
-
-    print(f"Attempting download for company {company_id} (up to 5 attempts)...")
-    resp = download_report_with_retries(session, download_url, data=download_payload, headers=headers, max_attempts=5, timeout=120)
-
-    if resp and resp.status_code == 200 and ("openxmlformats-officedocument.spreadsheetml.sheet" in resp.headers.get("content-type", "").lower() or resp.content.startswith(b"PK")):
-        company_label = "Zipper" if company_id == 1 else "Metal_Trims"
-        filename = f"ot_analysis_{company_label}_{DATE_FROM}_to_{DATE_TO}.xlsx"
-        with open(filename, "wb") as f:
-            f.write(resp.content)
-        print(f"✅ Report downloaded as {filename}")
-
-        # ---------------------- Step 7: Push to Google Sheets ----------------------
+    # xlsx is already a ZIP archive, so ask for it uncompressed: gzip on top would
+    # only cost CPU on both ends (the JSON-RPC calls keep gzip/deflate)
+    headers = {"X-CSRF-Token": csrf_token, "Referer": f"{ODOO_URL}/web", "Accept-Encoding": "identity"}
+
+    log.info("Attempting download for company %s...", company_id)
+    # Odoo renders the xlsx inside this request, so keep the long read budget for
+    # the render but fail fast (5s) when the server can't even be reached.
+    # Collect the body in memory; pandas reads it from there, no disk round-trip
+    buf = io.BytesIO()
+    downloaded = download_report(session, download_url, download_payload, buf, headers=headers, timeout=(5, 120))
+
+    if downloaded:
+        company = COMPANY_CONFIG[company_id]
+        filename = f"ot_analysis_{company['label']}_{date_from}_to_{date_to}.xlsx"
+        log.info("✅ Report downloaded (%s bytes)", buf.tell())
+        # Keep a copy of the xlsx on disk only when asked to (debugging/archival)
+        if os.getenv("KEEP_XLSX"):
+            with open(filename, "wb") as f:
+                f.write(buf.getbuffer())
+            log.info("✅ Report saved as %s", filename)
+        buf.seek(0)
+
+        # ---------------------- Step 6: Push to Google Sheets ----------------------
         try:
-            # Read the Excel file
-            df_cost = pd.read_excel(filename, sheet_name=1)
+            # Read the Excel report from memory
+            df_cost = read_report_sheet(buf, sheet_index=1)
             
-            print(f"\n📊 DataFrame shape: {df_cost.shape}")
-            print(f"📋 First few columns: {df_cost.columns.tolist()[:10]}")
-            print(f"\n🔍 Sample of row 2 (date header row):")
-            print(df_cost.iloc[2, :20].to_string())
+            log.info("📊 DataFrame shape: %s", df_cost.shape)
+            log.info("📋 First few columns: %s", df_cost.columns.tolist()[:10])
+            if log.getLogger().isEnabledFor(log.DEBUG):
+                log.debug("🔍 Sample of row 2 (date header row):\n%s", df_cost.iloc[2, :20].to_string())
             
             # Smart fix dates based on the date range
-            print(f"\n🔧 Applying smart date fixing...")
-            df_cost = smart_fix_dates_in_dataframe(df_cost, DATE_FROM, DATE_TO)
-            
-            print(f"\n✅ Sample after fixing:")
-            print(df_cost.iloc[2, :20].to_string())
-            
-            # Open Google Sheet
-            sheet_new = client.open_by_key("1-kBuln5CnKucuHqYG4vvgttJ8DqeJALvr4TjAYuVkXs")
-
-            if company_id == 1:  # Zipper
-                worksheet_new = sheet_new.worksheet("ZIP_OT_DATA")
-                clear_range = "B1:IA1000"
-            else:  # Metal Trims
-                worksheet_new = sheet_new.worksheet("MT_OT_DATA")
-                clear_range = "B1:IA1000"
+            log.info("🔧 Applying smart date fixing...")
+            df_cost = smart_fix_dates_in_dataframe(df_cost, date_from, date_to)
             
-            # Clear existing data
-            worksheet_new.batch_clear([clear_range])
-            print(f"✅ Cleared range {clear_range}")
+            if log.getLogger().isEnabledFor(log.DEBUG):
+                log.debug("✅ Sample after fixing:\n%s", df_cost.iloc[2, :20].to_string())
             
-            # Write dataframe to Google Sheets
-            set_with_dataframe(worksheet_new, df_cost, row=1, col=2, include_index=False, include_column_header=True)
-            print(f"✅ Data pushed to Google Sheets for company {company_id}")
+            push_report_to_sheet(spreadsheet, worksheets, row_counts, company_id, df_cost)
+            log.info("✅ Data pushed to Google Sheets for company %s", company_id)
+            return True
             
         except Exception as e:
-            print(f"❌ Failed to process/upload data for company {company_id}: {e}")
-            import traceback
-            traceback.print_exc()
-            continue
+            log.exception("❌ Failed to process/upload data for company %s: %s", company_id, e)
+            return False
     
     else:
-        # If download failed after retries
-        status = resp.status_code if resp is not None else "No response"
-        snippet = ""
-        try:
-            snippet = resp.text[:500] if resp else "<no response>"
-        except Exception:
-            snippet = "<binary content or no response>"
-        print(f"❌ Download failed after retries for company {company_id}. Status: {status}. Snippet: {snippet}")
-        print(" moving to next company...\n")
-        continue
-
-print("\n✅ All companies processed.")
\ No newline at end of file
+        # If download failed (status and snippet were logged by download_report)
+        log.error("❌ Download failed for company %s.", company_id)
+        log.info(" moving to next company...")
+        return False
+
+
+# ---------------------- Entry point
+def run(from_date, to_date, company_ids=COMPANY_IDS, sheet_key=SHEET_KEY, creds_path=SERVICE_ACCOUNT_FILE):
+    """
+    Fetch the OT analysis report for each company in company_ids for
+    from_date..to_date and push it to the Google Sheet sheet_key.
+    Companies are processed in parallel after a single login.
+    Returns {company_id: True/False} as reported by process_company.
+    """
+    creds = Credentials.from_service_account_file(creds_path, scopes=SCOPES)
+    client = gspread.authorize(creds)
+    # Open the spreadsheet once and resolve every worksheet from a single metadata fetch
+    spreadsheet = client.open_by_key(sheet_key)
+    worksheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+    # ...and every company's last row count from a single batchGet
+    row_counts = previous_row_counts(spreadsheet, [COMPANY_CONFIG[c]["worksheet"] for c in company_ids], ROW_COUNT_CELL)
+
+    session, uid, csrf_token = login()
+
+    # ---------------------- Run companies in parallel
+    # Authenticate once: every worker gets its own Session seeded with a snapshot
+    # of the login cookies (the Odoo session id) and the shared CSRF token string,
+    # so no worker ever calls /web/session/authenticate again.
+    worker = partial(process_company, uid=uid, csrf_token=csrf_token, cookies=session.cookies.copy(),
+                     spreadsheet=spreadsheet, worksheets=worksheets, row_counts=row_counts, date_from=from_date, date_to=to_date)
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(company_ids)) as executor:
+        futures = {executor.submit(worker, company_id): company_id for company_id in company_ids}
+        # Collect as each company finishes; one company blowing up doesn't hide the others
+        for future in as_completed(futures):
+            company_id = futures[future]
+            try:
+                results[company_id] = future.result()
+            except Exception as e:
+                log.exception("❌ Company %s crashed: %s", company_id, e)
+                results[company_id] = False
+
+    failed = [company_id for company_id, ok in results.items() if not ok]
+    if failed:
+        log.error("❌ Companies that failed: %s", failed)
+    log.info("✅ All companies processed.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--from_date", type=str, default=DATE_FROM_DEFAULT)
+    parser.add_argument("--to_date", type=str, default=DATE_TO_DEFAULT)
+    args = parser.parse_args()
+
+    run(args.from_date, args.to_date)
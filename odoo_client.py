@@ -0,0 +1,223 @@
+"""
+Odoo JSON-RPC transport and DataFrame / Google Sheets helpers shared by
+Ot_data_fetch.py, ot_head.py and purchase_orders.py.
+"""
+import orjson
+import random
+import time
+import logging as log
+import requests
+import gspread
+import pandas as pd
+from numbers import Real
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from gspread.utils import a1_to_rowcol, rowcol_to_a1, absolute_range_name
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def make_adapter(pool_maxsize=4, retry_statuses=()):
+    """
+    HTTPAdapter with a keep-alive pool of pool_maxsize connections per host.
+    urllib3 only retries what is safe to send again even for a non-idempotent
+    POST: failed connects (nothing was sent yet) and the retry_statuses, e.g.
+    408/429, where the server turned the request away without running it.
+    Read timeouts and 5xx are never retried here, so retry layers above this
+    don't multiply on a hung server. Backoff is 0s, 4s, 8s between tries,
+    never shorter than Retry-After; the last retry_statuses response is
+    handed back as is.
+    Share one adapter between sessions to share its connection pool.
+    """
+    return HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=5, connect=3, read=0, status=3, backoff_factor=2,
+                          status_forcelist=retry_statuses, respect_retry_after_header=True,
+                          allowed_methods=frozenset(["GET", "POST"]), raise_on_status=False),
+    )
+
+
+def make_session(pool_maxsize=4, cookies=None, headers=JSON_HEADERS, adapter=None):
+    """
+    requests.Session mounted on adapter (a new make_adapter(pool_maxsize) if not
+    given), with headers as its default headers. By default that is just the JSON
+    content type, for bodies sent pre-encoded with orjson.
+    If cookies are given (e.g. from the login session) they are copied in,
+    so the new session is already authenticated without logging in again.
+    """
+    session = requests.Session()
+    adapter = adapter or make_adapter(pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers)
+    if cookies is not None:
+        session.cookies.update(cookies)
+    return session
+
+
+def authenticate(session, url, db, login, password):
+    """
+    Log in through /web/session/authenticate; the session keeps the cookie.
+    Returns the uid, raises if Odoo doesn't hand one back.
+    """
+    payload = {
+        "jsonrpc": "2.0",
+        "params": {
+            "db": db,
+            "login": login,
+            "password": password
+        }
+    }
+    resp = session.post(f"{url}/web/session/authenticate", data=orjson.dumps(payload), timeout=60)
+    resp.raise_for_status()
+    auth_result = resp.json()
+    if not auth_result.get("result") or not auth_result["result"].get("uid"):
+        raise Exception("Login failed. Check credentials or access rights.")
+    return auth_result["result"]["uid"]
+
+
+def call_kw(session, url, model, method, args, kwargs, rpc_id=1, timeout=(10, 60)):
+    """
+    One /web/dataset/call_kw request. Returns the decoded JSON-RPC response, which
+    holds either "result" or "error"; HTTP errors raise, and a body that isn't JSON
+    raises ValueError (orjson.JSONDecodeError). timeout is (connect, read): fail
+    fast when Odoo can't be reached, but give the query itself a minute.
+    """
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "call",
+        "params": {
+            "model": model,
+            "method": method,
+            "args": args,
+            "kwargs": kwargs
+        },
+        "id": rpc_id
+    }
+    resp = session.post(f"{url}/web/dataset/call_kw/{model}/{method}", data=orjson.dumps(payload), timeout=timeout)
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
+def clean_frame(df, skip=()):
+    """
+    Clean many2one fields & nulls in place ([id, name] -> name, None/False -> ""),
+    per column on the frame instead of looping over every record key.
+    Columns in skip are left as they are.
+    """
+    for col in df.columns.difference(skip):
+        column = df[col]
+        if column.dtype == bool:
+            df[col] = column.where(column, "")
+            continue
+        # text columns are object dtype, or the str dtype pandas 3 infers for them
+        if not (pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column)):
+            continue
+        values = column.to_numpy(dtype=object, copy=True)
+        kinds = column.map(type)
+        lists = column[kinds.eq(list)]
+        pairs = lists[lists.str.len().eq(2)]
+        is_false = kinds.eq(bool).to_numpy() & (values == False)  # real False only, as 0 == False too
+        values[column.index.get_indexer(pairs.index)] = pairs.str[1].to_numpy(dtype=object)
+        values[column.isna().to_numpy() | is_false] = ""
+        df[col] = values
+    return df
+
+
+def dataframe_to_values(df):
+    """
+    Header + rows of df as plain lists for the Sheets values API, with cells
+    formatted the way set_with_dataframe did: blank for NaN,
+    numbers as-is, everything else as text.
+    The whole frame is handled as one flat object array with pandas/NumPy ops
+    instead of formatting every cell in a Python loop.
+    """
+    obj = df.astype(object)
+    for col in df.select_dtypes(include=["datetime", "datetimetz"]).columns:
+        obj[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    grid = obj.to_numpy(dtype=object)
+    cells = pd.Series(grid.ravel(), dtype=object)
+    blank = cells.isna()
+    kinds = cells.map(type)
+    # anything that isn't already text or a number (datetime, time, ...) goes to text
+    keep = [kind for kind in kinds.unique() if issubclass(kind, (str, Real))]
+    other = ~kinds.isin(keep) & ~blank
+    if other.any():
+        cells[other] = cells[other].astype(str)
+    # a leading apostrophe is Sheets' text marker, so double it to keep it
+    is_str = kinds.eq(str) | other
+    quoted = is_str & cells.where(is_str, "").str.startswith("'")
+    if quoted.any():
+        cells[quoted] = "'" + cells[quoted]
+    cells[blank] = ""
+
+    header = ["" if pd.isnull(name) else name if isinstance(name, Real) else str(name) for name in df.columns]
+    return [header] + cells.to_numpy().reshape(grid.shape).tolist()
+
+
+def write_dataframe_to_range(spreadsheet, worksheet, df, clear_range, row_count_cell=None, extra_cells=None):
+    """
+    Replace the contents of clear_range (e.g. "B1:IA1000") with df, header included,
+    in a single spreadsheets.values.batchUpdate call. The data block is padded with
+    blanks out to the clear range, so the old contents are cleared in the same write
+    instead of a separate batch_clear round-trip.
+    If row_count_cell is given, the number of rows written (header included) is
+    stored there in the same request, so the next run knows how much to clear.
+    extra_cells ({a1: value}, e.g. a timestamp) are written in the same request too.
+    """
+    values = dataframe_to_values(df)
+    start, end = clear_range.split(":")
+    start_row, start_col = a1_to_rowcol(start)
+    end_row, end_col = a1_to_rowcol(end)
+
+    width = max(end_col - start_col + 1, len(values[0]))
+    height = max(end_row - start_row + 1, len(values))
+    for row in values:
+        row.extend([""] * (width - len(row)))
+    values.extend([[""] * width for _ in range(height - len(values))])
+
+    # values API does not grow the grid, so make room like set_with_dataframe did
+    needed_rows = start_row + height - 1
+    needed_cols = start_col + width - 1
+    if needed_rows > worksheet.row_count or needed_cols > worksheet.col_count:
+        worksheet.resize(rows=max(needed_rows, worksheet.row_count), cols=max(needed_cols, worksheet.col_count))
+
+    data = [{"range": absolute_range_name(worksheet.title, rowcol_to_a1(start_row, start_col)), "values": values}]
+    if row_count_cell:
+        data.append({"range": absolute_range_name(worksheet.title, row_count_cell), "values": [[len(df) + 1]]})
+    for cell, value in (extra_cells or {}).items():
+        data.append({"range": absolute_range_name(worksheet.title, cell), "values": [[value]]})
+    spreadsheet.values_batch_update({"valueInputOption": "USER_ENTERED", "data": data})
+
+
+def retry_delay(attempt, resp=None, base=0.5, cap=60):
+    """
+    Seconds to wait before retry number attempt (0-based): exponential from base,
+    with +/-50% jitter so workers that failed together don't retry together,
+    capped at cap, but never shorter than the server's Retry-After (in seconds).
+    """
+    delay = min(cap, base * 2 ** attempt * (0.5 + random.random()))
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+
+def with_sheets_backoff(write, attempts=4):
+    """
+    Call write() and return its result. When Sheets answers 429 (rate limit) or
+    503 (unavailable), wait retry_delay() and try again, up to attempts calls in
+    all; any other error, or the last failed attempt, is raised.
+    """
+    for attempt in range(attempts):
+        try:
+            return write()
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code in (429, 503) and attempt < attempts - 1:
+                sleep_t = retry_delay(attempt, e.response)
+                log.warning(" Sheets API returned %s, retrying write in %.1fs ...", e.response.status_code, sleep_t)
+                time.sleep(sleep_t)
+            else:
+                raise
@@ -1,21 +1,21 @@
 import os
-import json
 import requests
 import pandas as pd
 import time
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 import logging as log
+from concurrent.futures import ThreadPoolExecutor
 import gspread
-from gspread_dataframe import set_with_dataframe
 from google.oauth2 import service_account
 from dotenv import load_dotenv
+from odoo_client import make_session, authenticate, call_kw, clean_frame, write_dataframe_to_range
 load_dotenv()
 
 # ----------------------------
 # Logging
 # ----------------------------
-log.basicConfig(level=log.INFO)
+log.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
 # ----------------------------
 # Odoo credentials (from GitHub secrets or env)
@@ -40,58 +40,32 @@ FIELDS = {
 # ----------------------------
 # Step 1: Authenticate via Odoo session
 # ----------------------------
-auth_url = f"{ODOO_URL}/web/session/authenticate"
-headers = {"Content-Type": "application/json"}
-auth_payload = {
-    "jsonrpc": "2.0",
-    "params": {
-        "db": ODOO_DB,
-        "login": ODOO_USERNAME,
-        "password": ODOO_PASSWORD
-    }
-}
-session = requests.Session()
-resp = session.post(auth_url, headers=headers, data=json.dumps(auth_payload))
-resp.raise_for_status()
-auth_result = resp.json()
-print("Auth response:", auth_result)
-if not auth_result.get("result") or not auth_result["result"].get("uid"):
-    raise Exception("Login failed. Check credentials or access rights.")
-uid = auth_result["result"]["uid"]
-log.info(f"✅ Logged in UID: {uid}")
+# Keep-alive pool big enough for both company contexts fetching PAGE_WORKERS pages at once
+session = make_session(pool_maxsize=16)
+uid = authenticate(session, ODOO_URL, ODOO_DB, ODOO_USERNAME, ODOO_PASSWORD)
+log.info("✅ Logged in")
+log.debug("UID: %s", uid)
 
 # ----------------------------
 # Step 2: Fetch all employees with active status (with retry logic)
 # ----------------------------
 def fetch_all_employees(context, max_retries=10):
     """Fetch all employees and their active status with retry logic"""
-    data_url = f"{ODOO_URL}/web/dataset/call_kw/hr.employee/search_read"
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "call",
-        "params": {
-            "model": "hr.employee",
-            "method": "search_read",
-            "args": [[]],  # Empty domain to get all employees
-            "kwargs": {
-                "fields": ["id", "name", "active"],
-                "context": context
-            }
-        },
-        "id": 1
+    kwargs = {
+        "fields": ["id", "name", "active"],
+        "context": context
     }
     
     for attempt in range(1, max_retries + 1):
         try:
-            resp = session.post(data_url, headers=headers, data=json.dumps(payload), timeout=60)
-            resp.raise_for_status()
-            resp_json = resp.json()
+            # Empty domain to get all employees
+            resp_json = call_kw(session, ODOO_URL, "hr.employee", "search_read", [[]], kwargs, rpc_id=1)
             
             if "result" not in resp_json:
-                log.error(f"Error fetching employees: {resp_json.get('error')}")
+                log.error("Error fetching employees: %s", resp_json.get('error'))
                 if attempt < max_retries:
                     wait_time = min(2 ** attempt, 60)
-                    log.info(f"⏳ Retrying in {wait_time} seconds...")
+                    log.info("⏳ Retrying in %s seconds...", wait_time)
                     time.sleep(wait_time)
                     continue
                 else:
@@ -99,19 +73,20 @@ def fetch_all_employees(context, max_retries=10):
             
             # Create a dictionary mapping employee_id to active status
             employee_dict = {emp['id']: emp['active'] for emp in resp_json['result']}
-            log.info(f"✅ Fetched {len(employee_dict)} employees with active status")
+            log.info("✅ Fetched %s employees with active status", len(employee_dict))
             return employee_dict
             
         except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, 
-                requests.exceptions.Timeout, requests.exceptions.RequestException) as e:
-            log.error(f"❌ Attempt {attempt}/{max_retries} failed fetching employees: {str(e)}")
+                requests.exceptions.Timeout, requests.exceptions.RequestException,
+                ValueError) as e:  # ValueError: body that isn't JSON (orjson.JSONDecodeError)
+            log.error("❌ Attempt %s/%s failed fetching employees: %s", attempt, max_retries, e)
             
             if attempt < max_retries:
                 wait_time = min(2 ** attempt, 60)
-                log.info(f"⏳ Waiting {wait_time} seconds before retry...")
+                log.info("⏳ Waiting %s seconds before retry...", wait_time)
                 time.sleep(wait_time)
             else:
-                log.error(f"❌ All {max_retries} attempts failed for fetching employees")
+                log.error("❌ All %s attempts failed for fetching employees", max_retries)
                 return {}
     
     return {}
@@ -121,142 +96,166 @@ def fetch_all_employees(context, max_retries=10):
 # ----------------------------
 fields_list = list(FIELDS.keys())
 limit = 1000
-local_tz = pytz.timezone('Asia/Dhaka')
+local_tz = ZoneInfo('Asia/Dhaka')
 from_date = "2024-04-01"
 to_date = datetime.now(local_tz).strftime("%Y-%m-%d")
 domain = ["&", ["attDate", ">=", from_date], ["attDate", "<=", to_date]]
 
-# Function to fetch attendance records for a given context with retry logic
+PAGE_WORKERS = 4  # attendance pages fetched at the same time (kept small to spare the Odoo server)
+
+# Call an hr.attendance method with retry logic; returns the RPC result, or None after max_retries.
+# With retry_errors=False an Odoo error reply returns None at once (only transport errors are
+# retried), for callers that have a fallback and gain nothing from asking the same thing again.
+def attendance_rpc(method, args, kwargs, what, max_retries=10, rpc_id=2, retry_errors=True):
+    for attempt in range(1, max_retries + 1):
+        try:
+            resp_json = call_kw(session, ODOO_URL, "hr.attendance", method, args, kwargs, rpc_id=rpc_id)
+            
+            if "result" in resp_json:
+                return resp_json["result"]
+            log.error("Error fetching %s: %s", what, resp_json.get('error'))
+            if not retry_errors:
+                return None
+            
+        except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, 
+                requests.exceptions.Timeout, requests.exceptions.RequestException,
+                ValueError) as e:  # ValueError: body that isn't JSON (orjson.JSONDecodeError)
+            log.error("❌ Attempt %s/%s failed for %s: %s", attempt, max_retries, what, e)
+        
+        if attempt < max_retries:
+            # Exponential backoff
+            wait_time = min(2 ** attempt, 60)
+            log.info("⏳ Waiting %s seconds before retry (%s)...", wait_time, what)
+            time.sleep(wait_time)
+    
+    log.error("❌ All %s attempts failed for %s", max_retries, what)
+    return None
+
+# Function to fetch attendance records for a given context with retry logic.
+# Counts the matching records first, then fetches the pages concurrently
+# (PAGE_WORKERS at a time) instead of one after another.
 def fetch_attendance(context, employee_dict, max_retries=10):
-    offset = 0
-    all_records = []
+    total = attendance_rpc("search_count", [domain], {"context": context}, "attendance count", max_retries, rpc_id=1)
+    if total is None:
+        return []
+    log.info("📊 %s attendance records to fetch in %s pages", total, -(-total // limit))
     
-    while True:
-        data_url = f"{ODOO_URL}/web/dataset/call_kw/hr.attendance/search_read"
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "call",
-            "params": {
-                "model": "hr.attendance",
-                "method": "search_read",
-                "args": [domain],
-                "kwargs": {
-                    "fields": fields_list,
-                    "limit": limit,
-                    "offset": offset,
-                    "context": context
-                }
-            },
-            "id": 2
-        }
-        
-        # Retry logic for each batch fetch
-        records = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                resp = session.post(data_url, headers=headers, data=json.dumps(payload), timeout=60)
-                resp.raise_for_status()
-                resp_json = resp.json()
-                
-                if "result" not in resp_json:
-                    log.error(f"Error fetching attendance at offset {offset}: {resp_json.get('error')}")
-                    if attempt < max_retries:
-                        wait_time = min(2 ** attempt, 60)
-                        log.info(f"⏳ Retrying in {wait_time} seconds...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        log.error(f"❌ Failed to fetch batch at offset {offset} after {max_retries} attempts")
-                        return all_records  # Return what we have so far
-                
-                records = resp_json["result"]
-                break  # Success, exit retry loop
-                
-            except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, 
-                    requests.exceptions.Timeout, requests.exceptions.RequestException) as e:
-                log.error(f"❌ Attempt {attempt}/{max_retries} failed at offset {offset}: {str(e)}")
-                
-                if attempt < max_retries:
-                    # Exponential backoff with jitter
-                    wait_time = min(2 ** attempt, 60)
-                    log.info(f"⏳ Waiting {wait_time} seconds before retry (current offset: {offset})...")
-                    time.sleep(wait_time)
-                else:
-                    log.error(f"❌ All {max_retries} attempts failed at offset {offset}")
-                    log.info(f"💾 Returning {len(all_records)} records fetched before error")
-                    return all_records  # Return partial results
-        
-        # Check if we got records
-        if records is None or not records:
-            log.info(f"✅ No more records to fetch. Total fetched: {len(all_records)}")
-            break
-        
-        # Add employee active status to each record
-        for record in records:
-            emp_id = record.get('employee_id')
-            if isinstance(emp_id, list) and len(emp_id) >= 1:
-                emp_id = emp_id[0]  # Get the ID from [id, name] format
-            record['employee_active'] = employee_dict.get(emp_id, True)  # Default to True if not found
+    def fetch_page(offset):
+        # order by id so concurrent pages slice one stable ordering
+        kwargs = {"fields": fields_list, "limit": limit, "offset": offset, "order": "id", "context": context}
+        return attendance_rpc("search_read", [domain], kwargs, f"attendance at offset {offset}", max_retries)
+    
+    offsets = list(range(0, total, limit))
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        pages = list(executor.map(fetch_page, offsets))
+    
+    all_records = []
+    for offset, records in zip(offsets, pages):
+        if records is None:
+            log.error("❌ Failed to fetch batch at offset %s after %s attempts", offset, max_retries)
+            log.info("💾 Returning %s records fetched before error", len(all_records))
+            return all_records  # Return partial results
         
+        add_employee_active(records, employee_dict)
         all_records.extend(records)
-        offset += limit
-        log.info(f"📊 Fetched {len(all_records)} records so far (current offset: {offset})...")
-        
-        # Small delay to avoid overwhelming the server
-        time.sleep(0.5)
     
+    log.info("✅ No more records to fetch. Total fetched: %s", len(all_records))
     return all_records
 
+# Add employee active status to each record
+def add_employee_active(records, employee_dict):
+    for record in records:
+        emp_id = record.get('employee_id')
+        if isinstance(emp_id, list) and len(emp_id) >= 1:
+            emp_id = emp_id[0]  # Get the ID from [id, name] format
+        record['employee_active'] = employee_dict.get(emp_id, True)  # Default to True if not found
+
+# First day of the month an attDate:month group covers, as "YYYY-MM-DD"
+def group_month_start(group):
+    month_range = (group.get("__range") or {}).get("attDate:month")
+    if month_range:
+        return month_range["from"]
+    for term in group.get("__domain", []):
+        if isinstance(term, (list, tuple)) and term[0] == "attDate" and term[1] == ">=":
+            return term[2][:10]
+    raise ValueError("no month bounds in read_group row")
+
+# Let Odoo sum the hours per month / employee / department / category with
+# read_group, so only one row per group crosses the wire instead of every
+# attendance record. Rows come back shaped like search_read records (attDate
+# is the month start), so the cleaning and groupby below work unchanged and
+# just fold groups that share a display name. Returns None on the first error
+# reply (e.g. the server can't group a non-stored field; asking again won't
+# change that), so the caller can fall back to fetching the raw records.
+def fetch_attendance_grouped(context, employee_dict, max_retries=3):
+    groupby = ["attDate:month", "employee_id", "department_id", "x_studio_category"]
+    measures = ["com_otHours:sum", "worked_hours:sum"]
+    kwargs = {"lazy": False, "context": context}
+    groups = attendance_rpc("read_group", [domain, measures, groupby], kwargs, "grouped attendance", max_retries,
+                            retry_errors=False)
+    if groups is None:
+        return None
+    
+    try:
+        records = [
+            {
+                "attDate": group_month_start(group),
+                "employee_id": group["employee_id"],
+                "department_id": group["department_id"],
+                "x_studio_category": group["x_studio_category"],
+                "com_otHours": group["com_otHours"] or 0.0,
+                "worked_hours": group["worked_hours"] or 0.0,
+            }
+            for group in groups
+            if group.get("attDate:month")  # no attDate means no month to report under
+        ]
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        log.error("❌ Unexpected read_group rows for grouped attendance: %s", e)
+        return None
+    
+    add_employee_active(records, employee_dict)
+    log.info("✅ Fetched %s grouped attendance rows (%s records)", len(records), sum(g.get("__count", 0) for g in groups))
+    return records
+
+# Grouped fetch first, raw records as the fallback
+def fetch_attendance_monthly(context, employee_dict):
+    records = fetch_attendance_grouped(context, employee_dict)
+    if records is None:
+        log.warning("⚠️ read_group unavailable, fetching raw attendance records instead")
+        records = fetch_attendance(context, employee_dict)
+    return records
+
 # ----------------------------
 # Fetch employees first (for both company contexts)
 # ----------------------------
+# The two company contexts are independent, so each step runs both at once
+# on the shared session (its pool covers 2 x PAGE_WORKERS connections)
 context_14 = {"lang": "en_US", "tz": "Asia/Dhaka", "uid": uid, "allowed_company_ids": [1, 4], "current_company_id": 1}
-employee_dict_14 = fetch_all_employees(context_14)
-
 context_34 = {"lang": "en_US", "tz": "Asia/Dhaka", "uid": uid, "allowed_company_ids": [3, 4], "current_company_id": 3}
-employee_dict_34 = fetch_all_employees(context_34)
 
-# ----------------------------
-# Fetch attendance for company ids 1 and 4
-# ----------------------------
-records_14 = fetch_attendance(context_14, employee_dict_14)
-log.info(f"Total records fetched for companies 1 & 4: {len(records_14)}")
-
-# ----------------------------
-# Fetch attendance for company ids 3 and 4
-# ----------------------------
-records_34 = fetch_attendance(context_34, employee_dict_34)
-log.info(f"Total records fetched for companies 3 & 4: {len(records_34)}")
+with ThreadPoolExecutor(max_workers=2) as executor:
+    future_14 = executor.submit(fetch_all_employees, context_14)
+    future_34 = executor.submit(fetch_all_employees, context_34)
+    employee_dict_14, employee_dict_34 = future_14.result(), future_34.result()
 
 # ----------------------------
-# Clean many2one fields & nulls
+# Fetch attendance for company ids 1 & 4 and 3 & 4
 # ----------------------------
-def clean_value(val):
-    if isinstance(val, list) and len(val) == 2:
-        return val[1]
-    elif val is None or val is False:
-        return ""
-    else:
-        return val
-
-for rec in records_14:
-    for key in rec.keys():
-        if key != 'employee_active':  # Don't clean the active field
-            rec[key] = clean_value(rec[key])
-
-for rec in records_34:
-    for key in rec.keys():
-        if key != 'employee_active':  # Don't clean the active field
-            rec[key] = clean_value(rec[key])
+with ThreadPoolExecutor(max_workers=2) as executor:
+    future_14 = executor.submit(fetch_attendance_monthly, context_14, employee_dict_14)
+    future_34 = executor.submit(fetch_attendance_monthly, context_34, employee_dict_34)
+    records_14, records_34 = future_14.result(), future_34.result()
+log.info("Total records fetched for companies 1 & 4: %s", len(records_14))
+log.info("Total records fetched for companies 3 & 4: %s", len(records_34))
 
 # ----------------------------
-# Convert to DataFrames and rename columns
+# Convert to DataFrames, clean many2one fields & nulls
 # ----------------------------
 # Update field mapping to include employee active
 FIELDS['employee_active'] = 'Employee/Active'
 
-df_14 = pd.DataFrame(records_14)
-df_34 = pd.DataFrame(records_34)
+df_14 = clean_frame(pd.DataFrame(records_14), skip=['employee_active'])  # Don't clean the active field
+df_34 = clean_frame(pd.DataFrame(records_34), skip=['employee_active'])
 
 # Check if DataFrames are empty
 if df_14.empty:
@@ -268,16 +267,16 @@ else:
     # ----------------------------
     # Standardize Date to First Day of Month
     # ----------------------------
-    df_14['Date'] = pd.to_datetime(df_14['Date'])
-    df_14['Date'] = df_14['Date'].dt.to_period('M').dt.to_timestamp()
-    log.info(f"✅ Standardized dates to first day of month for companies 1 & 4")
+    # numpy month floor (datetime64[M]) instead of a to_period / to_timestamp round trip
+    df_14['Date'] = pd.to_datetime(df_14['Date']).to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    log.info("✅ Standardized dates to first day of month for companies 1 & 4")
     
     # ----------------------------
     # Group by specified columns and sum OT and Worked hours
     # ----------------------------
     group_cols = ['Date', 'Employee', 'Department', 'Category', 'Employee/Active']
     grouped_14 = df_14.groupby(group_cols, as_index=False).agg({'OT Hours ': 'sum', 'Worked Hours': 'sum'})
-    log.info(f"Grouped data for companies 1 & 4: {len(grouped_14)} rows")
+    log.info("Grouped data for companies 1 & 4: %s rows", len(grouped_14))
 
 if df_34.empty:
     log.warning("⚠️ No records fetched for companies 3 & 4. Skipping processing.")
@@ -288,16 +287,16 @@ else:
     # ----------------------------
     # Standardize Date to First Day of Month
     # ----------------------------
-    df_34['Date'] = pd.to_datetime(df_34['Date'])
-    df_34['Date'] = df_34['Date'].dt.to_period('M').dt.to_timestamp()
-    log.info(f"✅ Standardized dates to first day of month for companies 3 & 4")
+    # numpy month floor (datetime64[M]) instead of a to_period / to_timestamp round trip
+    df_34['Date'] = pd.to_datetime(df_34['Date']).to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    log.info("✅ Standardized dates to first day of month for companies 3 & 4")
     
     # ----------------------------
     # Group by specified columns and sum OT and Worked hours
     # ----------------------------
     group_cols = ['Date', 'Employee', 'Department', 'Category', 'Employee/Active']
     grouped_34 = df_34.groupby(group_cols, as_index=False).agg({'OT Hours ': 'sum', 'Worked Hours': 'sum'})
-    log.info(f"Grouped data for companies 3 & 4: {len(grouped_34)} rows")
+    log.info("Grouped data for companies 3 & 4: %s rows", len(grouped_34))
 
 # ----------------------------
 # Paste into Google Sheets with Retry Logic
@@ -310,19 +309,21 @@ client = gspread.authorize(creds)
 
 # Get the service account email for sharing instructions
 service_account_email = creds.service_account_email
-log.info(f"📧 Service Account Email: {service_account_email}")
+log.info("📧 Service Account Email: %s", service_account_email)
 log.info("⚠️  Make sure this email has Editor access to the Google Sheet!")
 
 try:
     sheet = client.open_by_key("1OOwRMvGMgZ0lLsq3VLWmqGWF9WsqLj6N72Bdn-0-PNw")
 except PermissionError as e:
-    log.error(f"❌ Permission Error: The service account ({service_account_email}) doesn't have access to the spreadsheet.")
+    log.error("❌ Permission Error: The service account (%s) doesn't have access to the spreadsheet.", service_account_email)
     log.error("📝 To fix: Open the Google Sheet and share it with the service account email as an Editor.")
     raise
 
 # ----------------------------
 # Function to paste data with retry logic
 # ----------------------------
+CLEAR_END_COLUMN = "G"  # A:G, the grouped attendance columns
+
 def paste_to_sheet_with_retry(worksheet, dataframe, worksheet_name, max_retries=10):
     """
     Paste dataframe to Google Sheet with retry logic
@@ -337,38 +338,35 @@ def paste_to_sheet_with_retry(worksheet, dataframe, worksheet_name, max_retries=
         bool: True if successful, False otherwise
     """
     if dataframe.empty:
-        log.info(f"Skip: Grouped DataFrame for {worksheet_name} is empty, not pasting to sheet.")
+        log.info("Skip: Grouped DataFrame for %s is empty, not pasting to sheet.", worksheet_name)
         return True
     
     for attempt in range(1, max_retries + 1):
         try:
-            log.info(f"📝 Attempt {attempt}/{max_retries}: Pasting data to {worksheet_name}...")
-            
-            # Clear the worksheet
-            worksheet.batch_clear(["A:G"])
-            time.sleep(2)
-            
-            # Paste the dataframe
-            set_with_dataframe(worksheet, dataframe, row=1, col=1)
-            log.info(f"✅ Grouped data pasted to Google Sheet ({worksheet_name}).")
+            log.info("📝 Attempt %s/%s: Pasting data to %s...", attempt, max_retries, worksheet_name)
             
-            # Add timestamp
+            # Written over A:G down to the bottom of the grid, the block this paste owns:
+            # old rows are cleared by the same values.batchUpdate as the data and the
+            # timestamp; the leading apostrophe keeps the timestamp as plain text
+            clear_range = f"A1:{CLEAR_END_COLUMN}{max(worksheet.row_count, len(dataframe) + 1)}"
             local_time = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
-            worksheet.update("AC1", [[f"{local_time}"]])
-            log.info(f"✅ Timestamp updated for {worksheet_name}: {local_time}")
+            write_dataframe_to_range(worksheet.spreadsheet, worksheet, dataframe, clear_range,
+                                     extra_cells={"AC1": f"'{local_time}"})
+            log.info("✅ Grouped data pasted to Google Sheet (%s): %s rows.", worksheet_name, len(dataframe))
+            log.info("✅ Timestamp updated for %s: %s", worksheet_name, local_time)
             
             return True
             
         except Exception as e:
-            log.error(f"❌ Attempt {attempt}/{max_retries} failed for {worksheet_name}: {str(e)}")
+            log.error("❌ Attempt %s/%s failed for %s: %s", attempt, max_retries, worksheet_name, e)
             
             if attempt < max_retries:
                 # Exponential backoff: wait longer between each retry
                 wait_time = min(2 ** attempt, 60)  # Cap at 60 seconds
-                log.info(f"⏳ Waiting {wait_time} seconds before retry...")
+                log.info("⏳ Waiting %s seconds before retry...", wait_time)
                 time.sleep(wait_time)
             else:
-                log.error(f"❌ All {max_retries} attempts failed for {worksheet_name}")
+                log.error("❌ All %s attempts failed for %s", max_retries, worksheet_name)
                 return False
     
     return False
@@ -1,21 +1,19 @@
 import os
-import json
-import requests
 import pandas as pd
-import glob
-import time
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 import logging as log
 
 import gspread
-from gspread_dataframe import set_with_dataframe
+from gspread.utils import rowcol_to_a1
 from google.oauth2 import service_account
 
+from odoo_client import make_session, authenticate, call_kw, clean_frame, dataframe_to_values, with_sheets_backoff
+
 # ----------------------------
 # Logging
 # ----------------------------
-log.basicConfig(level=log.INFO)
+log.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
 # ----------------------------
 # Odoo credentials (from GitHub secrets or env)
@@ -25,6 +23,8 @@ ODOO_DB = os.getenv("ODOO_DB")
 ODOO_USERNAME = os.getenv("USERNAME")
 ODOO_PASSWORD = os.getenv("PASSWORD")
 
+local_tz = ZoneInfo('Asia/Dhaka')
+
 # ----------------------------
 # Field mapping
 # ----------------------------
@@ -51,27 +51,10 @@ FIELDS = {
 # ----------------------------
 # Step 1: Authenticate via Odoo session
 # ----------------------------
-auth_url = f"{ODOO_URL}/web/session/authenticate"
-headers = {"Content-Type": "application/json"}
-
-auth_payload = {
-    "jsonrpc": "2.0",
-    "params": {
-        "db": ODOO_DB,
-        "login": ODOO_USERNAME,
-        "password": ODOO_PASSWORD
-    }
-}
-
-session = requests.Session()
-resp = session.post(auth_url, headers=headers, data=json.dumps(auth_payload))
-resp.raise_for_status()
-auth_result = resp.json()
-if not auth_result.get("result") or not auth_result["result"].get("uid"):
-    raise Exception("Login failed. Check credentials or access rights.")
-
-uid = auth_result["result"]["uid"]
-log.info(f"✅ Logged in UID: {uid}")
+session = make_session()
+uid = authenticate(session, ODOO_URL, ODOO_DB, ODOO_USERNAME, ODOO_PASSWORD)
+log.info("✅ Logged in")
+log.debug("UID: %s", uid)
 
 # ----------------------------
 # Step 2: Fetch purchase.order data (paginated)
@@ -82,30 +65,16 @@ offset = 0
 all_records = []
 
 while True:
-    data_url = f"{ODOO_URL}/web/dataset/call_kw/purchase.order/search_read"
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "call",
-        "params": {
-            "model": "purchase.order",
-            "method": "search_read",
-            "args": [],
-            "kwargs": {
-                "fields": fields_list,
-                "limit": limit,
-                "offset": offset,
-                "context": {"lang": "en_US", "tz": "Asia/Dhaka", "uid": uid}
-            }
-        },
-        "id": 2
+    kwargs = {
+        "fields": fields_list,
+        "limit": limit,
+        "offset": offset,
+        "context": {"lang": "en_US", "tz": "Asia/Dhaka", "uid": uid}
     }
-
-    resp = session.post(data_url, headers=headers, data=json.dumps(payload))
-    resp.raise_for_status()
-    resp_json = resp.json()
+    resp_json = call_kw(session, ODOO_URL, "purchase.order", "search_read", [], kwargs, rpc_id=2)
 
     if "result" not in resp_json:
-        log.error(f"Error fetching purchase orders: {resp_json.get('error')}")
+        log.error("Error fetching purchase orders: %s", resp_json.get('error'))
         break
 
     records = resp_json["result"]
@@ -114,55 +83,19 @@ while True:
 
     all_records.extend(records)
     offset += limit
-    log.info(f"Fetched {len(all_records)} records so far...")
+    log.info("Fetched %s records so far...", len(all_records))
 
-log.info(f"Total records fetched: {len(all_records)}")
+log.info("Total records fetched: %s", len(all_records))
 
 # ----------------------------
-# Step 3: Clean many2one fields & nulls
-# ----------------------------
-def clean_value(val):
-    if isinstance(val, list) and len(val) == 2:
-        return val[1]
-    elif val is None or val is False:
-        return ""
-    else:
-        return val
-
-for rec in all_records:
-    for key in rec.keys():
-        rec[key] = clean_value(rec[key])
-
+# Step 3: Convert to DataFrame, clean many2one fields & nulls
 # ----------------------------
-# Step 4: Convert to DataFrame
-# ----------------------------
-df = pd.DataFrame(all_records)
+df = clean_frame(pd.DataFrame(all_records))
 df.rename(columns=FIELDS, inplace=True)
 
 # ----------------------------
-# Step 5: Save to Excel
-# ----------------------------
-os.makedirs("downloads", exist_ok=True)
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-filename = f"downloads/purchase_orders_{timestamp}.xlsx"
-df.to_excel(filename, index=False)
-log.info(f"✅ Downloaded & cleaned file saved: {filename}")
-
-# ----------------------------
-# Step 6: Find latest file matching pattern
+# Step 4: Paste into Google Sheet
 # ----------------------------
-list_of_files = glob.glob("downloads/purchase_orders_*.xlsx")
-latest_file = max(list_of_files, key=os.path.getctime)
-log.info(f"✅ Latest file selected: {latest_file}")
-
-# ----------------------------
-# Step 7: Paste into Google Sheet
-# ----------------------------
-# Wait a bit to ensure file is ready
-time.sleep(5)
-df = pd.read_excel(latest_file)
-log.info("✅ File loaded into DataFrame.")
-
 # Load Google service account credentials (gcreds.json stored in GitHub Secrets)
 scope = ["https://www.googleapis.com/auth/spreadsheets",
          "https://www.googleapis.com/auth/drive"]
@@ -177,12 +110,17 @@ if df.empty:
     log.info("Skip: DataFrame is empty, not pasting to sheet.")
 else:
     worksheet.clear()
-    time.sleep(2)
-    set_with_dataframe(worksheet, df)
+    # One values.update for the whole frame instead of set_with_dataframe's per-cell path
+    values = dataframe_to_values(df)
+    end_cell = rowcol_to_a1(len(values), len(values[0]))
+    if len(values) > worksheet.row_count or len(values[0]) > worksheet.col_count:
+        worksheet.resize(rows=max(len(values), worksheet.row_count), cols=max(len(values[0]), worksheet.col_count))
+    # Back off (jittered, honouring Retry-After) and retry the write on rate limit / unavailable
+    with_sheets_backoff(lambda: worksheet.update(range_name=f"A1:{end_cell}", values=values,
+                                                 value_input_option="USER_ENTERED"))
     log.info("✅ Data pasted to Google Sheet (PO_Status_Data).")
 
     # Add timestamp
-    local_tz = pytz.timezone('Asia/Dhaka')
     local_time = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
     worksheet.update("AC1", [[f"{local_time}"]])
-    log.info(f"✅ Timestamp updated: {local_time}")
+    log.info("✅ Timestamp updated: %s", local_time)